@@ -1,5 +1,7 @@
 from functools import wraps
+import heapq
 import threading
+import weakref
 
 
 class UsageError(Exception):
@@ -10,6 +12,49 @@ class UsageError(Exception):
     pass
 
 
+class _Flag(object):  # Inherit object for Python2 compatibility
+    """
+    A stand-in for threading.Event that can't be waited on. Setting and
+    clearing a threading.Event goes through a Condition, which is wasted work
+    when nobody is waiting. Storing a bool is atomic on its own, so this needs
+    no lock at all.
+    """
+    __slots__ = ("_value",)
+
+    def __init__(self):
+        self._value = False
+
+    def set(self):
+        self._value = True
+
+    def clear(self):
+        self._value = False
+
+    def is_set(self):
+        return self._value
+
+
+class _Registration(object):  # Inherit object for Python2 compatibility
+    """
+    Event._register returns one of these, which you pass to Event._unregister
+    to undo the registration. It keeps track of where the registration lives
+    within the Event, so that undoing it doesn't require a search.
+    """
+    __slots__ = ("position",)
+
+    def __init__(self, position):
+        self.position = position
+
+
+class _Reference(weakref.ref):
+    """
+    A weak reference to a function registered with an Event, which remembers
+    the _Registration it belongs to, so that once the function has been
+    collected the Event can find and drop it without a search.
+    """
+    __slots__ = ("registration",)
+
+
 def _atomic(func):
     """
     A decorator to acquire an object's lock for the entirety of a function.
@@ -21,10 +66,71 @@ def _atomic(func):
     return inner
 
 
+# Setting or clearing an Event notifies its dependents, which may in turn set or
+# clear themselves and notify their own dependents, and so on down the DAG.
+# Rather than doing this recursively, the outermost _set() or _clear() on each
+# thread drains a queue of Events whose dependents still need notifying, and
+# anything that changes while it does so is added to that queue. The queue is
+# ordered by each Event's rank, which is greater than those of all its
+# ancestors, so by the time an Event comes out of the queue everything
+# upstream of it has settled. Each Event therefore notifies its dependents at
+# most once, however many paths through the DAG a change reaches it by.
+_propagation = threading.local()
+
+
+def _propagate(event):
+    """
+    Notifies the dependents of an Event that just changed, once those of any
+    Events upstream of it on this thread have been notified.
+    """
+    queue = getattr(_propagation, "queue", None)
+    if queue is not None:
+        # Someone further up our stack is already draining the queue.
+        pending = _propagation.pending
+        if event not in pending:
+            pending.add(event)
+            heapq.heappush(queue, (event._rank, id(event), event))
+        return
+
+    # Pending Events are never queued twice, so the ids break any ties in rank
+    # and we never end up comparing the Events themselves.
+    queue = [(event._rank, id(event), event)]
+    pending = set([event])
+    _propagation.queue = queue
+    _propagation.pending = pending
+    # Look these up once, rather than on every trip around the loop.
+    heappop = heapq.heappop
+    discard = pending.discard
+    # Each Event we notify, and how many times it had changed when we did.
+    notified = []
+    try:
+        while queue:
+            event = heappop(queue)[2]
+            discard(event)
+            notified.append((event, event._changes))
+            event._notify()
+        # Only once the queue is empty has everything downstream of those
+        # changes been told about them. See Event._set.
+        for event, changes in notified:
+            event._finish_notifying(changes)
+    finally:
+        _propagation.queue = None
+        _propagation.pending = None
+
+
+# Most Events never have anything registered with them, so rather than giving
+# each one its own empty containers of callbacks and registrations, they share
+# this until something registers. Checking for it is a single identity
+# comparison.
+_NO_DEPENDENTS = ()
+
+
 class _ContextManagerMixin(object):  # Inherit object for Python2 compatibility
     """
     Inherit from this for Events that are created within a context manager.
     """
+    __slots__ = ()
+
     def __enter__(self):
         return self
 
@@ -42,41 +148,139 @@ class Event(_ContextManagerMixin):
     You can pass these into `AnyEvent` or `AllEvent` below to join
     these together. Beyond that, they act like `threading.Event` objects.
     """
+    # Programs can create a great many of these, so we avoid giving each one
+    # a __dict__. Subclasses that don't declare __slots__ still get one.
+    __slots__ = ("_event", "_lock", "_callbacks", "_registrations",
+                 "_snapshot", "_collected", "_changes", "_notified", "_rank",
+                 "__weakref__")
+
+    # What we keep our state in. On Python 2, threading.Event is a function
+    # rather than a class, so without staticmethod it would become a method.
+    _event_type = staticmethod(threading.Event)
+
     def __init__(self):
-        self._event = threading.Event()
-        # We have a lock to make _set() and _clear() atomic. It is re-entrant
-        # so that we can create a callback that can atomically check various
-        # conditions before running set or clear, without deadlocking (used in
-        # AnyEvent and AllEvent, below).
-        self._lock = threading.RLock()
-        # We keep a mapping from other Event-like objects to pairs of (set,
-        # clear) nullary functions.
-        self._dependents = {}
+        self._event = self._event_type()
+        # We have a lock to protect our registrations and, in combination
+        # events, our state. Nothing tries to acquire it while already holding
+        # it, so it needn't be re-entrant, and a plain Lock is cheaper than an
+        # RLock because it doesn't track which thread owns it.
+        self._lock = threading.Lock()
+        # We keep a list of weak references to functions that take this Event
+        # as their only argument, and get called whenever it is set or
+        # cleared. Alongside it is a list of the _Registrations for those
+        # functions. Both are modified in place while holding our lock. The
+        # references are weak so that a dependent nobody else refers to can be
+        # garbage collected without calling destruct().
+        self._callbacks = _NO_DEPENDENTS
+        self._registrations = _NO_DEPENDENTS
+        # Notifying our dependents walks a tuple copied from _callbacks, so
+        # that it needs neither our lock nor a copy of its own. Registering
+        # and unregistering just set this to None, and the next notification
+        # makes a fresh copy, so that registering a great many dependents at
+        # once doesn't copy the callbacks each time.
+        self._snapshot = _NO_DEPENDENTS
+        # When one of those functions is collected, its reference gets
+        # appended here by the garbage collector, and we drop it the next time
+        # someone registers with us or we notify our dependents. Appending to a
+        # list is atomic, so the collector needn't take our lock, which it may
+        # well be running inside of.
+        self._collected = _NO_DEPENDENTS
+        # How many times we've changed while we had dependents, and how many of
+        # those changes our dependents are known to have heard about. When
+        # these differ, some thread is still part way through telling them,
+        # so anyone else who sets or clears us mustn't assume they're up to
+        # date just because we already had the state they wanted.
+        self._changes = 0
+        self._notified = 0
+        # Our position in the DAG: every Event has a higher rank than all of
+        # its ancestors. See _propagate, above.
+        self._rank = 0
+
+    # Our dependents look at us when they hear from us, rather than trusting
+    # what they're told (see _ComboEvent._update), so neither _set nor _clear
+    # needs to hold our lock while notifying them. Until something registers
+    # with us, they don't take it at all: threading.Event is thread-safe on its
+    # own.
+    def _set(self):
+        event = self._event
+        if self._callbacks is _NO_DEPENDENTS:
+            event.set()
+            if self._callbacks is _NO_DEPENDENTS:
+                return
+            # Someone registered with us in the meantime, and may have looked
+            # at us before we were set, so they still need to hear about it.
+        else:
+            lock = self._lock
+            lock.acquire()
+            try:
+                if not event.is_set():
+                    event.set()
+                    self._changes += 1
+                elif self._notified == self._changes:
+                    return  # Nothing changed, so there's nobody to tell.
+            finally:
+                lock.release()
+        # Even if we were already set, another thread may not have finished
+        # telling our dependents about it, and our caller shouldn't see them
+        # until it has. Telling them again is harmless.
+        _propagate(self)
 
-    def set(self):
-        self._set()
+    def _clear(self):
+        event = self._event
+        if self._callbacks is _NO_DEPENDENTS:
+            event.clear()
+            if self._callbacks is _NO_DEPENDENTS:
+                return
+        else:
+            lock = self._lock
+            lock.acquire()
+            try:
+                if event.is_set():
+                    event.clear()
+                    self._changes += 1
+                elif self._notified == self._changes:
+                    return
+            finally:
+                lock.release()
+        _propagate(self)
+
+    # The public set() and clear() are the same functions as _set() and
+    # _clear(), rather than wrappers around them, to save a Python function
+    # call on every use. Combination events override them to raise instead.
+    set = _set
+    clear = _clear
+
+    def _notify(self):  # Called by _propagate to tell our dependents we changed
+        # We don't take our lock here, so propagating a change never holds
+        # more than one Event's lock at a time, and we cannot have a deadlock.
+        callbacks = self._snapshot
+        if callbacks is None:
+            callbacks = self._take_snapshot()
+        for reference in callbacks:
+            function = reference()
+            if function is not None:
+                function(self)
+        if self._collected:
+            self._prune()
 
-    def clear(self):
-        self._clear()
+    @_atomic
+    def _finish_notifying(self, changes):
+        # Everything downstream of us has now heard about our first `changes`
+        # changes, though another thread may have finished telling it about
+        # later ones already.
+        if changes > self._notified:
+            self._notified = changes
 
     @_atomic
-    def _set(self):
-        self._event.set()
-        # Note that the graph of all Event objects and their dependents is
-        # a DAG, and that setting or clearing any Event will only need to
-        # acquire the locks of the descendents of that Event. Consequently,
-        # we cannot have a deadlock: that would require two Events that are
-        # each others' descendents, and that cannot happen in a DAG.
-        for set_function, clear_function in self._dependents.values():
-            set_function()
+    def _prune(self):  # Drop registrations whose functions have been collected
+        self._remove_collected()
 
     @_atomic
-    def _clear(self):
-        self._event.clear()
-        # Similar to the implementation of set, we cannot have a deadlock
-        # here because the Events form a DAG.
-        for set_function, clear_function in self._dependents.values():
-            clear_function()
+    def _take_snapshot(self):
+        callbacks = self._snapshot
+        if callbacks is None:
+            callbacks = self._snapshot = tuple(self._callbacks)
+        return callbacks
 
     def is_set(self):
         return self._event.is_set()
@@ -85,39 +289,171 @@ class Event(_ContextManagerMixin):
         return self._event.wait(*args, **kws)
 
     @_atomic
-    def _register(self, registrant, set_function, clear_function):
-        if registrant in self._dependents:
-            raise UsageError("Cannot register an event twice")
-        self._dependents[registrant] = (set_function, clear_function)
+    def _register(self, function):
+        # We only keep a weak reference to the function, so it's up to the
+        # caller to keep it alive for as long as it should be called.
+        return self._add_registration(function)
+
+    def _add_registration(self, function):  # Call this with our lock held
+        if self._collected:
+            # Otherwise an Event that never changes would hold on to the
+            # references of every dependent that was ever collected.
+            self._remove_collected()
+        if self._registrations is _NO_DEPENDENTS:
+            self._registrations = []
+            self._callbacks = []
+            self._collected = []
+            # A thread on the fast path through _set or _clear may have just
+            # changed us without our lock. Count that as a change, so nobody
+            # else returns before it's been propagated to this new dependent.
+            self._changes += 1
+        registration = _Registration(len(self._registrations))
+        self._registrations.append(registration)
+        reference = _Reference(function, self._collected.append)
+        reference.registration = registration
+        self._callbacks.append(reference)
+        self._snapshot = None
+        return registration
 
     @_atomic
-    def _unregister(self, registrant):
-        if registrant not in self._dependents:
+    def _unregister(self, registration):
+        position = registration.position
+        if (position is None or position >= len(self._registrations) or
+                self._registrations[position] is not registration):
             raise UsageError("Cannot unregister an event we never saw")
-        self._dependents.pop(registrant)
+        self._remove(registration)
+
+    def _remove(self, registration):  # Call this with our lock held
+        position = registration.position
+        registration.position = None
+        if len(self._registrations) == 1:
+            # Go back to taking the fast path through _set and _clear.
+            self._callbacks = _NO_DEPENDENTS
+            self._registrations = _NO_DEPENDENTS
+            self._snapshot = _NO_DEPENDENTS
+            self._collected = _NO_DEPENDENTS
+            return
+        # Move the last registration into the slot we're freeing up, so that
+        # only the one we move needs to learn its new position.
+        function = self._callbacks.pop()
+        last = self._registrations.pop()
+        if last is not registration:
+            self._callbacks[position] = function
+            self._registrations[position] = last
+            last.position = position
+        self._snapshot = None
+
+    def _remove_collected(self):  # Call this with our lock held
+        collected = self._collected
+        while collected:
+            registration = collected.pop().registration
+            # Skip any that were unregistered before they were collected.
+            if registration.position is not None:
+                self._remove(registration)
+
+
+def _register_all(events, function):
+    """
+    Like calling `_register(function)` on each of the events, returning their
+    _Registrations in the same order, but with a single pass over their locks
+    rather than a trip through _atomic for each. The locks are taken in order
+    of id(), so that two of these running at once cannot deadlock.
+    """
+    acquired = []
+    try:
+        for event in sorted(events, key=id):
+            event._lock.acquire()
+            acquired.append(event._lock)
+
+        return [event._add_registration(function) for event in events]
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+
+# The rules a combination event can use to combine its ancestors' states. See
+# _ComboEvent._evaluate, below.
+_NOT, _ANY, _ALL = range(3)
 
 
 class _ComboEvent(Event):
+    # Most combination events are only ever looked at with is_set(), or used
+    # as ancestors of other combination events, so we keep our state in a
+    # _Flag until someone actually wants to wait on us. See wait(), below.
+    _event_type = staticmethod(_Flag)
+
+    _mode = None  # Which of the rules above we follow; set by subclasses
+
+    __slots__ = ("_ancestors", "_ancestor_states", "_set_count", "_callback",
+                 "_tokens")
+
     def __init__(self, *events):
         """
         We combine all the input events together when creating this one, using
-        the callbacks defined in subclasses. Think of this as an abstract base
-        class.
+        the rule given by the subclass's _mode. Think of this as an abstract
+        base class.
         """
+        if self._mode is None:
+            # Check this before registering with anything, rather than waiting
+            # for _evaluate to find out.
+            raise NotImplementedError
+        if len(set(events)) != len(events):
+            raise UsageError("Cannot register an event twice")
+
         super(_ComboEvent, self).__init__()
         self._ancestors = events
+        self._rank = 1 + max([0] + [event._rank for event in events])
+        # The state of each ancestor as of the last time we heard from it,
+        # and a count of how many of those were set. That way a change to any
+        # one ancestor is O(1), and working out our own state never needs to
+        # look through them all. Notifications are delivered after the
+        # ancestor has released its lock, so when several threads are involved
+        # they can arrive late or out of order. Rather than trusting them, we
+        # look at the ancestor itself, and ignore any notification that
+        # doesn't change anything.
+        self._ancestor_states = {}
+        self._set_count = 0
+        # Every access to self._update creates a new bound method, so make one
+        # up front for all our ancestors to share. Our ancestors only keep weak
+        # references to it, so this is also what keeps it alive for as long as
+        # we are.
+        self._callback = self._update
 
         with self._lock:
+            # The _Registrations we get from our ancestors, in the same order.
+            self._tokens = _register_all(self._ancestors, self._callback)
+            # Only look at our ancestors once we're registered with them, so
+            # that any later change is sure to reach _update.
             for event in self._ancestors:
-                event._register(self, self._set_callback, self._clear_callback)
+                is_set = event.is_set()
+                self._ancestor_states[event] = is_set
+                if is_set:
+                    self._set_count += 1
 
-            self._initialize()
+            if self._evaluate(self._set_count):
+                self._event.set()
 
     def destruct(self):
-        # Before we can go out of scope, we need to remove ourselves from all
-        # our ancestors, so that they don't hold references to us.
-        for event in self._ancestors:
-            event._unregister(self)
+        # Our ancestors only hold weak references to us, so we'll be removed
+        # from them eventually if we go out of scope without this. Calling it
+        # stops them notifying us straight away, though.
+        for event, token in zip(self._ancestors, self._tokens):
+            event._unregister(token)
+
+    def wait(self, *args, **kws):
+        event = self._event
+        if type(event) is _Flag:
+            # Swap our _Flag for a threading.Event in the same state. Our
+            # state only changes while our lock is held, so doing this under
+            # the lock means no change can be lost.
+            with self._lock:
+                event = self._event
+                if type(event) is _Flag:
+                    event = threading.Event()
+                    if self._event.is_set():
+                        event.set()
+                    self._event = event
+        return event.wait(*args, **kws)
 
     def set(self):
         raise UsageError("Don't set combination events directly.")
@@ -125,13 +461,49 @@ class _ComboEvent(Event):
     def clear(self):
         raise UsageError("Don't clear combination events directly.")
 
-    def _initialize(self):  # Called to initialize the state at the beginning
-        raise NotImplementedError
-
-    def _set_callback(self):  # Called when one of our ancestors is set
-        raise NotImplementedError
-
-    def _clear_callback(self):  # Called when one of our ancestors is cleared
+    def _update(self, ancestor):  # Called when one of our ancestors changes
+        # This is on the hot path, so we handle the lock by hand rather than
+        # using _atomic, which skips a function call and the context manager
+        # protocol.
+        lock = self._lock
+        lock.acquire()
+        try:
+            is_set = ancestor.is_set()
+            if self._ancestor_states[ancestor] != is_set:
+                self._ancestor_states[ancestor] = is_set
+                if is_set:
+                    self._set_count += 1
+                else:
+                    self._set_count -= 1
+
+                event = self._event
+                is_set = self._evaluate(self._set_count)
+                if is_set != event.is_set():
+                    if is_set:
+                        event.set()
+                    else:
+                        event.clear()
+                    self._changes += 1
+            # Like Event._set, we pass this on if another thread is still
+            # telling our dependents about an earlier change, so that whoever
+            # started this doesn't finish before they've heard about it.
+            if self._notified == self._changes:
+                return
+        finally:
+            lock.release()
+        # Only tell our dependents about the change once we've released our
+        # lock, so that their updates don't hold up other threads updating us.
+        _propagate(self)
+
+    def _evaluate(self, set_count):
+        # Whether we should be set, given how many of our ancestors are set.
+        mode = self._mode
+        if mode == _ANY:
+            return set_count != 0
+        if mode == _ALL:
+            return set_count == len(self._ancestors)
+        if mode == _NOT:
+            return not set_count
         raise NotImplementedError
 
 
@@ -140,44 +512,25 @@ class InverseEvent(_ComboEvent):
     This event is the inverse of the event passed in on initialization.  If the
     base event is cleared, this is set and vice versa.
     """
+    __slots__ = ()
+
+    _mode = _NOT
+
     def __init__(self, event):
         # The difference between this __init__ and _ComboEvent.__init__ is that
         # this one only accepts a single parent Event, whereas _ComboEvent can
         # have arbitrarily many.
         super(InverseEvent, self).__init__(event)
 
-    def _initialize(self):
-        if all(not event.is_set() for event in self._ancestors):
-            # There is just the one ancestor, but we look for "all" of them to
-            # simplify the statement.
-            self._set()
-
-    @_atomic
-    def _set_callback(self):
-        self._clear()
-
-    @_atomic
-    def _clear_callback(self):
-        self._set()
-
 
 class AnyEvent(_ComboEvent):
     """
     This Event gets set whenever any event in the constructor list is set, and
     gets cleared when they're all cleared.
     """
-    @_atomic
-    def _set_callback(self):
-        self._set()
-
-    @_atomic
-    def _clear_callback(self):
-        if not any(event.is_set() for event in self._ancestors):
-            self._clear()
+    __slots__ = ()
 
-    def _initialize(self):
-        if any(event.is_set() for event in self._ancestors):
-            self._event.set()
+    _mode = _ANY
 
 
 class AllEvent(_ComboEvent):
@@ -185,15 +538,6 @@ class AllEvent(_ComboEvent):
     This Event gets set whenever all the events in the constructor list are
     set, and gets cleared when any of them are cleared.
     """
-    @_atomic
-    def _set_callback(self):
-        if all(event.is_set() for event in self._ancestors):
-            self._set()
-
-    @_atomic
-    def _clear_callback(self):
-        self._clear()
+    __slots__ = ()
 
-    def _initialize(self):
-        if all(event.is_set() for event in self._ancestors):
-            self._event.set()
+    _mode = _ALL
@@ -0,0 +1,196 @@
+import gc
+import itertools
+import random
+import threading
+import time
+import unittest
+import weakref
+
+from events import (AllEvent, AnyEvent, Event, InverseEvent, UsageError,
+                    _ComboEvent, _Flag, _NO_DEPENDENTS)
+
+
+def _run_in_thread(function):
+    thread = threading.Thread(target=function)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _set_to(event, is_set):
+    if is_set:
+        event.set()
+    else:
+        event.clear()
+
+
+class TruthTableTest(unittest.TestCase):
+    def _check(self, make_combo, rule, count):
+        events = [Event() for _ in range(count)]
+        combo = make_combo(*events)
+        for states in itertools.product([False, True], repeat=count):
+            for event, is_set in zip(events, states):
+                _set_to(event, is_set)
+            self.assertEqual(combo.is_set(), rule(states), states)
+            # A combination event made now should agree with the old one.
+            self.assertEqual(make_combo(*events).is_set(), rule(states),
+                             states)
+
+    def test_any(self):
+        self._check(AnyEvent, any, 3)
+
+    def test_all(self):
+        self._check(AllEvent, all, 3)
+
+    def test_inverse(self):
+        self._check(InverseEvent, lambda states: not states[0], 1)
+
+    def test_nested(self):
+        self._check(
+            lambda a, b, c: AllEvent(AnyEvent(a, b), InverseEvent(c)),
+            lambda states: (states[0] or states[1]) and not states[2], 3)
+
+    def test_reached_by_two_paths(self):
+        # Setting a changes both b and c, but d should only change once.
+        a = Event()
+        b = AnyEvent(a)
+        c = AllEvent(a)
+        d = AnyEvent(b, c)
+        heard = []
+        callback = heard.append  # d only holds this weakly
+        d._register(callback)
+        a.set()
+        self.assertTrue(d.is_set())
+        self.assertEqual(heard, [d])
+        a.clear()
+        self.assertFalse(d.is_set())
+        self.assertEqual(heard, [d, d])
+
+    def test_combination_events_cannot_be_set(self):
+        combo = AnyEvent(Event())
+        self.assertRaises(UsageError, combo.set)
+        self.assertRaises(UsageError, combo.clear)
+
+    def test_bad_constructions(self):
+        a = Event()
+        self.assertRaises(UsageError, AnyEvent, a, a)
+        self.assertRaises(NotImplementedError, _ComboEvent, a)
+        self.assertIs(a._callbacks, _NO_DEPENDENTS)
+
+
+class LifetimeTest(unittest.TestCase):
+    def test_destruct(self):
+        a = Event()
+        combo = AnyEvent(a)
+        combo.destruct()
+        self.assertIs(a._callbacks, _NO_DEPENDENTS)
+        a.set()
+        self.assertFalse(combo.is_set())
+        # There's nothing left to unregister the second time around.
+        self.assertRaises(UsageError, combo.destruct)
+
+    def test_context_manager(self):
+        a = Event()
+        with AllEvent(a) as combo:
+            a.set()
+            self.assertTrue(combo.is_set())
+        self.assertIs(a._callbacks, _NO_DEPENDENTS)
+
+    def test_collected_without_destruct(self):
+        a = Event()
+        kept = AnyEvent(a)
+        combos = [weakref.ref(AnyEvent(a)) for _ in range(100)]
+        gc.collect()
+        self.assertEqual([combo() for combo in combos], [None] * 100)
+        # Registering something else drops the ones that were collected.
+        also_kept = AllEvent(a)
+        self.assertEqual(len(a._registrations), 2)
+        a.set()
+        self.assertTrue(kept.is_set())
+        self.assertTrue(also_kept.is_set())
+
+
+class WaitTest(unittest.TestCase):
+    def test_wait_promotes_flag(self):
+        a = Event()
+        combo = AnyEvent(a)
+        self.assertIs(type(combo._event), _Flag)
+        self.assertFalse(combo.wait(0))
+        self.assertIsNot(type(combo._event), _Flag)
+
+    def test_wait_wakes_up(self):
+        a = Event()
+        combo = AnyEvent(a)
+        results = []
+        waiter = _run_in_thread(lambda: results.append(combo.wait(10)))
+        while type(combo._event) is _Flag:
+            time.sleep(0.001)
+        a.set()
+        waiter.join()
+        self.assertEqual(results, [True])
+
+
+class PropagationTest(unittest.TestCase):
+    def _check_second_set_waits(self, root, stuck, leaf):
+        # The first thread's root.set() changes `stuck` and then gets stuck
+        # telling `leaf`, because we're holding leaf's lock. A second
+        # root.set() finds nothing to change, but mustn't return until `leaf`
+        # has heard about it.
+        seen = []
+        leaf._lock.acquire()
+        try:
+            first = _run_in_thread(root.set)
+            while not stuck.is_set():
+                time.sleep(0.001)
+            second = _run_in_thread(
+                lambda: seen.append(root.set() or leaf.is_set()))
+            second.join(0.1)
+            self.assertTrue(second.is_alive())
+        finally:
+            leaf._lock.release()
+        first.join()
+        second.join()
+        self.assertEqual(seen, [True])
+
+    def test_set_waits_for_another_threads_propagation(self):
+        a = Event()
+        self._check_second_set_waits(a, a, AnyEvent(a))
+
+    def test_update_waits_for_another_threads_propagation(self):
+        # The same, but one step further down the DAG.
+        a = Event()
+        b = AnyEvent(a)
+        self._check_second_set_waits(a, b, AnyEvent(b))
+
+    def test_many_threads(self):
+        leaves = [Event() for _ in range(6)]
+        combos = []
+        rules = []
+        for _ in range(30):
+            events = random.sample(leaves + combos, 3)
+            combo_type = random.choice([AnyEvent, AllEvent])
+            combos.append(combo_type(*events))
+            rules.append((combo_type, events))
+            combos.append(InverseEvent(combos[-1]))
+            rules.append((InverseEvent, [combos[-2]]))
+
+        def toggle():
+            for _ in range(2000):
+                _set_to(random.choice(leaves), random.random() < 0.5)
+
+        threads = [_run_in_thread(toggle) for _ in range(4)]
+        for thread in threads:
+            thread.join()
+        for combo, (combo_type, events) in zip(combos, rules):
+            states = [event.is_set() for event in events]
+            if combo_type is AnyEvent:
+                expected = any(states)
+            elif combo_type is AllEvent:
+                expected = all(states)
+            else:
+                expected = not states[0]
+            self.assertEqual(combo.is_set(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()